@@ -1,7 +1,11 @@
-import os
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
 import streamlit as st
 
-from helper import ChatBot, current_year
+from helper import ChatBot, current_year, synthesize_speech
 
 # ----------------------------
 # UI helpers
@@ -10,20 +14,30 @@ def display_intro():
     st.caption(f"SearchBot (Q&A + Memory + Answer Modes) • {current_year()}")
 
 def configure_sidebar() -> dict:
+    """
+    Widgets are keyed so their values live in st.session_state; the
+    settings dict is read from there rather than from return values.
+    """
     st.sidebar.header("Settings")
 
-    mode = st.sidebar.selectbox(
+    st.sidebar.selectbox(
         "Answer mode",
         ["Short", "Detailed", "Bullet points", "Explain like I'm 5", "Interview answer"],
-        index=0
+        index=0,
+        key="mode"
     )
 
-    memory_turns = st.sidebar.slider("Memory (last N messages)", 2, 20, 10)
-    enable_tts = st.sidebar.checkbox("Enable speech (TTS)", value=True)
+    st.sidebar.slider(
+        "Memory (at least N recent messages)", 2, 20, 10,
+        key="memory_turns",
+        help="The model sees between N and 2N recent messages; the window only "
+             "moves every N messages so repeated context stays cacheable."
+    )
+    st.sidebar.checkbox("Enable speech (TTS)", value=True, key="enable_tts")
 
     st.sidebar.divider()
     st.sidebar.subheader("Quick Questions")
-    quick = st.sidebar.radio(
+    st.sidebar.radio(
         "Pick one",
         [
             "Explain K-Means in simple terms.",
@@ -31,21 +45,29 @@ def configure_sidebar() -> dict:
             "Give me interview answer: Why do you want this role?",
             "Summarize overfitting vs underfitting.",
         ],
-        index=0
+        index=0,
+        key="quick_question"
     )
-    ask_quick = st.sidebar.button("Ask selected question")
+    st.sidebar.button("Ask selected question", key="ask_quick")
 
+    state = st.session_state
     return {
-        "mode": mode,
-        "memory_turns": memory_turns,
-        "enable_tts": enable_tts,
-        "quick_question": quick,
-        "ask_quick": ask_quick,
+        "mode": state.mode,
+        "memory_turns": state.memory_turns,
+        "enable_tts": state.enable_tts,
+        "quick_question": state.quick_question,
+        "ask_quick": state.ask_quick,
     }
 
+MAX_HISTORY_MESSAGES = 100  # last 50 user/assistant turns
+
 def initialize_chat():
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    elif len(st.session_state.messages) > MAX_HISTORY_MESSAGES:
+        dropped = len(st.session_state.messages) - MAX_HISTORY_MESSAGES
+        del st.session_state.messages[:dropped]
+        st.session_state.window_start = max(0, st.session_state.get("window_start", 0) - dropped)
 
 def show_chat_history():
     for msg in st.session_state.messages:
@@ -54,32 +76,146 @@ def show_chat_history():
         with st.chat_message(role):
             st.markdown(content, unsafe_allow_html=True)
 
+# ----------------------------
+# ChatBot (one instance across reruns)
+# ----------------------------
+@st.cache_resource
+def get_bot() -> ChatBot:
+    """
+    ChatBot holds no per-conversation state (only the lock-guarded semantic
+    cache), so a single instance is shared by every rerun and session.
+    """
+    return ChatBot()
+
+@st.cache_data(ttl=86400, max_entries=64, show_spinner=False)
+def cached_quick_answer(question: str, mode: str) -> str:
+    """
+    Quick questions are asked without history, so the answer depends only
+    on (question, mode). Failures raise and are therefore not cached.
+    """
+    return get_bot().generate_response(user_input=question, mode=mode, fallback=False)
+
+def get_quick_answer(question: str, mode: str) -> Optional[str]:
+    try:
+        return cached_quick_answer(question, mode)
+    except Exception:
+        return None
+
 # ----------------------------
 # TTS (safe)
 # ----------------------------
-def text_to_speech(text: str, out_path: str = "output.mp3") -> bool:
+TTS_CHUNK_CHARS = 200
+TTS_WORKERS = 4  # gTTS rate-limits aggressive clients
+TTS_TIMEOUT_SEC = 30
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+@st.cache_resource
+def get_tts_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+
+def _pack_sentence(current: str, sentence: str, max_chars: int) -> Tuple[List[str], str]:
     """
-    Generates output.mp3 using gTTS if available.
-    Returns True if created successfully, else False.
+    One greedy packing step: add sentence to the chunk being built and
+    return (chunks this closed, chunk now being built). A sentence longer
+    than max_chars is cut at the last space that fits.
     """
+    sentence = sentence.strip()
+    if not sentence:
+        return [], current
+    if current and len(current) + 1 + len(sentence) <= max_chars:
+        return [], f"{current} {sentence}"
+    closed = [current] if current else []
+    while len(sentence) > max_chars:
+        cut = sentence.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars
+        closed.append(sentence[:cut])
+        sentence = sentence[cut:].strip()
+    return closed, sentence
+
+def split_for_speech(text: str, max_chars: int = TTS_CHUNK_CHARS) -> list:
+    """
+    Pack whole sentences into chunks of at most max_chars.
+    """
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text):
+        closed, current = _pack_sentence(current, sentence, max_chars)
+        chunks.extend(closed)
+    if current:
+        chunks.append(current)
+    return chunks
+
+def start_speech(text: str) -> List[Future]:
+    """
+    Submit gTTS synthesis of text to the TTS pool, one future per chunk,
+    so it runs while the answer is being rendered.
+    """
+    pool = get_tts_pool()
+    return [pool.submit(synthesize_speech, chunk) for chunk in split_for_speech(text)]
+
+def speak_as_streamed(chunks: Iterator[str], futures: List[Future]) -> Iterator[str]:
+    """
+    Pass streamed text through unchanged, starting synthesis of each speech
+    chunk as soon as its sentences are complete. Text is only cut at
+    sentence ends and packed exactly as split_for_speech packs the full
+    answer, so chunk texts do not depend on stream timing and repeat
+    answers hit the synthesize_speech cache.
+    Futures are appended to `futures` in answer order.
+    """
+    pool = get_tts_pool()
+    pending = ""  # text after the last sentence end seen so far
+    current = ""
+    for chunk in chunks:
+        yield chunk
+        pending += chunk
+        *sentences, pending = _SENTENCE_END.split(pending)
+        for sentence in sentences:
+            closed, current = _pack_sentence(current, sentence, TTS_CHUNK_CHARS)
+            futures.extend(pool.submit(synthesize_speech, c) for c in closed)
+    closed, current = _pack_sentence(current, pending, TTS_CHUNK_CHARS)
+    if current:
+        closed.append(current)
+    futures.extend(pool.submit(synthesize_speech, c) for c in closed)
+
+def collect_speech(futures: List[Future]) -> Optional[bytes]:
+    """
+    Join the chunk MP3s in order. Returns None if there is nothing to
+    play, any chunk failed, or all chunks are not done within
+    TTS_TIMEOUT_SEC overall; unfinished chunks are then cancelled.
+    """
+    if not futures:
+        return None
+    deadline = time.monotonic() + TTS_TIMEOUT_SEC
     try:
-        from gtts import gTTS
-        tts = gTTS(text=text)
-        tts.save(out_path)
-        return True
+        return b"".join(f.result(timeout=max(0, deadline - time.monotonic())) for f in futures)
     except Exception:
-        return False
+        for f in futures:
+            f.cancel()
+        return None
 
 # ----------------------------
 # Memory helper
 # ----------------------------
 def get_memory_slice(messages, last_n: int):
     """
-    Return last_n messages (user+assistant) for context.
+    Return recent messages (user+assistant) for context.
+
+    The window holds between last_n and 2*last_n messages. Its start only
+    moves forward when the window grows past 2*last_n, and then jumps to
+    the last last_n messages. Between jumps consecutive requests share an
+    identical prefix, which OpenAI's prompt cache reuses. Raising last_n
+    pulls the start back so the window never holds fewer than last_n.
     """
     if not messages:
         return []
-    return messages[-last_n:]
+    start = st.session_state.get("window_start", 0)
+    start = min(start, max(0, len(messages) - last_n))
+    if len(messages) - start > 2 * last_n:
+        start = len(messages) - last_n
+    st.session_state.window_start = start
+    return messages[start:]
 
 # ----------------------------
 # Main
@@ -97,37 +233,46 @@ def run_app():
     prefill = settings["quick_question"] if settings["ask_quick"] else ""
 
     user_input = st.chat_input("Ask a question...")
-    if not user_input and prefill:
+    is_quick = not user_input and bool(prefill)
+    if is_quick:
         user_input = prefill
 
     if not user_input:
         return
 
-    # --- Show user message + store
-    st.chat_message("user").markdown(user_input)
-    st.session_state.messages.append({"role": "user", "content": user_input})
-
     # --- Build memory slice for the model (A: conversation memory)
     memory = get_memory_slice(st.session_state.messages, settings["memory_turns"])
 
-    # --- Generate answer (B: answer modes)
-    bot = ChatBot()
-    answer = bot.generate_response(
-        user_input=user_input,
-        history=memory,
-        mode=settings["mode"]
-    )
+    # --- Show user message + store
+    st.chat_message("user").markdown(user_input)
+    st.session_state.messages.append({"role": "user", "content": user_input, "mode": settings["mode"]})
 
-    # --- Show assistant answer + store
+    # --- Answer + store (B: answer modes); quick questions come from cache
+    bot = get_bot()
     with st.chat_message("assistant"):
-        st.markdown(answer, unsafe_allow_html=True)
+        answer = get_quick_answer(user_input, settings["mode"]) if is_quick else None
+        speech = []
+        if answer is not None:
+            if settings["enable_tts"]:
+                speech = start_speech(answer)
+            st.markdown(answer, unsafe_allow_html=True)
+        else:
+            # A failed quick question already missed the semantic cache
+            stream = bot.stream_answer(
+                user_input=user_input,
+                history=memory,
+                mode=settings["mode"],
+                semantic_cache=not is_quick
+            )
+            if settings["enable_tts"]:
+                stream = speak_as_streamed(stream, speech)
+            answer = st.write_stream(stream)
 
         # Speech
         if settings["enable_tts"]:
-            ok = text_to_speech(answer, out_path="output.mp3")
-            audio_path = "output.mp3"
-            if ok and os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
-                st.audio(audio_path, format="audio/mpeg", loop=False)
+            audio = collect_speech(speech)
+            if audio:
+                st.audio(audio, format="audio/mpeg", loop=False)
             else:
                 st.caption("Audio not available.")
 
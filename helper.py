@@ -1,24 +1,41 @@
+import io
 import os
 import logging
-from typing import List, Dict, Optional
+import threading
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterator, List, Dict, Optional, Tuple
 
-# ===================== LOAD OPENAI KEY =====================
-try:
-    import streamlit as st
-    OPENAI_API_KEY = st.secrets.get("OPENAI_API_KEY")
-except Exception:
-    OPENAI_API_KEY = None
+if TYPE_CHECKING:
+    import numpy as np
+    from openai import OpenAI
 
-if not OPENAI_API_KEY:
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# ===================== OPENAI CLIENT =====================
+def _load_api_key() -> Optional[str]:
+    try:
+        import streamlit as st
+        api_key = st.secrets.get("OPENAI_API_KEY")
+    except Exception:
+        api_key = None
 
-if not OPENAI_API_KEY:
-    raise RuntimeError(
-        "OPENAI_API_KEY is not set. Add it in Streamlit Cloud → Settings → Secrets."
-    )
+    return api_key or os.getenv("OPENAI_API_KEY")
+
+@lru_cache(maxsize=1)
+def _get_client() -> "OpenAI":
+    """
+    Build the OpenAI client on first use and reuse it for the process.
+    A missing key raises here, so it is retried on the next call.
+    openai (with pydantic and httpx) is imported here, not at module load,
+    so the first page render does not pay for it.
+    """
+    from openai import OpenAI
 
-from openai import OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+    api_key = _load_api_key()
+    if not api_key:
+        raise RuntimeError(
+            "OPENAI_API_KEY is not set. Add it in Streamlit Cloud → Settings → Secrets."
+        )
+    return OpenAI(api_key=api_key)
 
 # ===================== LOGGER =====================
 _base_logger = logging.getLogger("searchbot")
@@ -41,9 +58,33 @@ class AppLoggerAdapter:
 app_logger = AppLoggerAdapter(_base_logger)
 
 # ===================== UTILS =====================
+_YEAR_CACHE = {"year": 0, "until": 0.0}
+
 def current_year() -> int:
-    from datetime import datetime
-    return datetime.now().year
+    """
+    Current year, re-read from the clock at most once an hour.
+    """
+    now = time.time()
+    if now >= _YEAR_CACHE["until"]:
+        from datetime import datetime
+        _YEAR_CACHE["year"] = datetime.now().year
+        _YEAR_CACHE["until"] = now + 3600
+    return _YEAR_CACHE["year"]
+
+# ===================== SPEECH =====================
+SPEECH_REQUEST_TIMEOUT_SEC = 10  # per gTTS HTTP request; None would wait forever
+
+@lru_cache(maxsize=256)
+def synthesize_speech(text: str, lang: str = "en") -> bytes:
+    """
+    MP3 bytes for text via gTTS, memoized per (text, lang).
+    Lives here rather than in app1.py so the cache survives Streamlit
+    reruns and can be called from worker threads.
+    """
+    from gtts import gTTS
+    buf = io.BytesIO()
+    gTTS(text=text, lang=lang, timeout=SPEECH_REQUEST_TIMEOUT_SEC).write_to_fp(buf)
+    return buf.getvalue()
 
 # ===================== ANSWER MODES =====================
 MODE_INSTRUCTIONS = {
@@ -54,73 +95,268 @@ MODE_INSTRUCTIONS = {
     "Interview answer": "Answer like a confident interview response."
 }
 
+# Identical on every request so OpenAI's prompt cache can reuse the prefix;
+# the per-turn mode instruction travels in the user message instead.
+_SYSTEM_PROMPT = (
+    "You are SearchBot, a helpful assistant. A user message may start with "
+    "an answer-style instruction followed by a line containing only ---; "
+    "follow that instruction when answering the text after it."
+)
+_SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+
+# "<instruction>\n---\n" per mode, built once; a turn is prefix + question.
+_MODE_PREFIXES = {mode: f"{instruction}\n---\n" for mode, instruction in MODE_INSTRUCTIONS.items()}
+
+# ===================== STREAMING =====================
+STREAM_FLUSH_CHARS = 16
+STREAM_FLUSH_SEC = 0.03
+
+# ===================== FALLBACK ANSWERS =====================
+# Used when the model is unreachable. An entry applies when all of its
+# keywords occur as substrings of the lowercased question (a keyword inside
+# a longer one still counts); the first applicable entry wins.
+FALLBACK_ANSWERS = [
+    (
+        frozenset({"overfitting", "underfitting"}),
+        "Overfitting means the model memorizes training data and fails on new data. "
+        "Underfitting means the model is too simple to learn patterns."
+    ),
+    (
+        frozenset({"k-means"}),
+        "K-Means is an unsupervised algorithm that groups data into K clusters "
+        "based on distance from cluster centers."
+    ),
+    (
+        frozenset({"ridge", "lasso"}),
+        "Ridge regression shrinks coefficients but keeps all features, "
+        "while Lasso can reduce some coefficients to zero."
+    ),
+]
+
+DEFAULT_FALLBACK_ANSWER = (
+    "I can help with this question. Please try rephrasing it or ask something more specific."
+)
+
+# ===================== SEMANTIC CACHE =====================
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+class SemanticCache:
+    """
+    Answers keyed by question embedding, partitioned by answer mode.
+    Rows are L2-normalized, so a lookup is one matrix-vector product.
+    numpy is imported in the methods that build arrays, not at module
+    load, so importing helper does not pay for it.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 512):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple["np.ndarray", List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def embed(self, text: str) -> "np.ndarray":
+        import numpy as np
+
+        response = _get_client().embeddings.create(model=EMBEDDING_MODEL, input=text)
+        vec = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def lookup(self, mode: str, vec: "np.ndarray") -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(mode)
+            if entry is None:
+                return None
+            vectors, answers = entry
+            sims = vectors @ vec
+            best = int(sims.argmax())
+            return answers[best] if sims[best] >= self.threshold else None
+
+    def add(self, mode: str, vec: "np.ndarray", answer: str) -> None:
+        import numpy as np
+
+        # Streamed and non-streamed answers share entries; store one form
+        answer = answer.strip()
+        with self._lock:
+            entry = self._entries.get(mode)
+            if entry is None:
+                self._entries[mode] = (vec[None, :], [answer])
+                return
+            vectors, answers = entry
+            vectors = np.vstack([vectors, vec])
+            answers.append(answer)
+            if len(answers) > self.max_entries:
+                vectors = vectors[1:]
+                del answers[0]
+            self._entries[mode] = (vectors, answers)
+
 # ===================== CHATBOT =====================
 class ChatBot:
     def __init__(self, model: str = "gpt-4o-mini"):
         self.model = model
+        self.semantic_cache = SemanticCache()
+        # Fixed request options, built once instead of per call
+        self._completion_kwargs = {"model": model, "temperature": 0.4}
+        self._stream_kwargs = {**self._completion_kwargs, "stream": True}
         app_logger.log_info("ChatBot initialized")
 
-    def _system_prompt(self, mode: str) -> str:
-        return MODE_INSTRUCTIONS.get(mode, MODE_INSTRUCTIONS["Short"])
+    def _user_turn(self, user_input: str, mode: str) -> str:
+        return _MODE_PREFIXES.get(mode, _MODE_PREFIXES["Short"]) + user_input
+
+    def _build_messages(
+        self,
+        user_input: str,
+        history: Optional[List[Dict[str, str]]],
+        mode: str
+    ) -> List[Dict[str, str]]:
+        """
+        Append-only layout: fixed system prompt, then prior turns exactly as
+        they were sent, then the new turn with its mode instruction folded in.
+        User history entries carrying a "mode" key are re-sent with that
+        mode's instruction so the prefix stays byte-identical.
+        """
+        messages = [_SYSTEM_MESSAGE]
+
+        if history:
+            for msg in history:
+                if msg.get("role") == "user" and msg.get("mode"):
+                    messages.append({
+                        "role": "user",
+                        "content": self._user_turn(msg["content"], msg["mode"])
+                    })
+                elif msg.get("role") in ("user", "assistant"):
+                    messages.append({
+                        "role": msg["role"],
+                        "content": msg["content"]
+                    })
+
+        messages.append({"role": "user", "content": self._user_turn(user_input, mode)})
+        return messages
+
+    def _semantic_lookup(
+        self,
+        user_input: str,
+        history: Optional[List[Dict[str, str]]],
+        mode: str
+    ) -> Tuple[Optional[str], Optional["np.ndarray"]]:
+        """
+        (cached answer, question vector). Only turns without history are
+        cached, since only their answer is independent of the conversation.
+        """
+        if history:
+            return None, None
+        try:
+            vec = self.semantic_cache.embed(user_input)
+        except Exception as e:
+            app_logger.log_error(f"Embedding failed: {repr(e)}")
+            return None, None
+        return self.semantic_cache.lookup(mode, vec), vec
 
     def generate_response(
         self,
         user_input: str,
         history: Optional[List[Dict[str, str]]] = None,
-        mode: str = "Short"
+        mode: str = "Short",
+        fallback: bool = True
     ) -> str:
+        """
+        Return the full answer. With fallback=False errors are raised
+        instead of answered from _fallback_answer, so callers can avoid
+        caching them.
+        """
+        cached, vec = self._semantic_lookup(user_input, history, mode)
+        if cached is not None:
+            return cached
+
         try:
-            messages = [
-                {"role": "system", "content": self._system_prompt(mode)}
-            ]
-
-            if history:
-                for msg in history:
-                    if msg.get("role") in ("user", "assistant"):
-                        messages.append({
-                            "role": msg["role"],
-                            "content": msg["content"]
-                        })
-
-            messages.append({"role": "user", "content": user_input})
-
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.4
+            response = _get_client().chat.completions.create(
+                messages=self._build_messages(user_input, history, mode),
+                **self._completion_kwargs
             )
 
             answer = response.choices[0].message.content
             if answer:
-                return answer.strip()
+                answer = answer.strip()
+                if vec is not None:
+                    self.semantic_cache.add(mode, vec, answer)
+                return answer
 
             raise RuntimeError("Empty response")
 
         except Exception as e:
             app_logger.log_error(f"OpenAI failed: {repr(e)}")
+            if not fallback:
+                raise
             return self._fallback_answer(user_input, mode)
 
-    def _fallback_answer(self, question: str, mode: str) -> str:
-        q = question.lower()
+    def stream_answer(
+        self,
+        user_input: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        mode: str = "Short",
+        semantic_cache: bool = True
+    ) -> Iterator[str]:
+        """
+        Yield the answer in pieces as the model produces them. Token deltas
+        are coalesced until STREAM_FLUSH_CHARS characters or STREAM_FLUSH_SEC
+        seconds have built up, so the UI re-renders per chunk, not per token.
+        If the request fails before any text arrives, yield the fallback answer instead.
+        semantic_cache=False skips the cache lookup, for callers that have
+        already made one for this question.
+        """
+        cached, vec = (
+            self._semantic_lookup(user_input, history, mode)
+            if semantic_cache else (None, None)
+        )
+        if cached is not None:
+            yield cached
+            return
 
-        if "overfitting" in q and "underfitting" in q:
-            return (
-                "Overfitting means the model memorizes training data and fails on new data. "
-                "Underfitting means the model is too simple to learn patterns."
+        collected = []
+        flushed = 0  # collected[:flushed] has been yielded
+        pending_chars = 0
+        last_flush = time.monotonic()
+        try:
+            stream = _get_client().chat.completions.create(
+                messages=self._build_messages(user_input, history, mode),
+                **self._stream_kwargs
             )
 
-        if "k-means" in q:
-            return (
-                "K-Means is an unsupervised algorithm that groups data into K clusters "
-                "based on distance from cluster centers."
-            )
+            for event in stream:
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if not delta:
+                    continue
+                collected.append(delta)
+                pending_chars += len(delta)
+                now = time.monotonic()
+                if pending_chars >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_SEC:
+                    yield "".join(collected[flushed:])
+                    flushed = len(collected)
+                    pending_chars = 0
+                    last_flush = now
 
-        if "ridge" in q and "lasso" in q:
-            return (
-                "Ridge regression shrinks coefficients but keeps all features, "
-                "while Lasso can reduce some coefficients to zero."
-            )
+            if not collected:
+                raise RuntimeError("Empty response")
 
-        return (
-            "I can help with this question. Please try rephrasing it or ask something more specific."
-        )
+            if flushed < len(collected):
+                yield "".join(collected[flushed:])
+
+            if vec is not None:
+                self.semantic_cache.add(mode, vec, "".join(collected))
+
+        except Exception as e:
+            app_logger.log_error(f"OpenAI stream failed: {repr(e)}")
+            if flushed < len(collected):
+                yield "".join(collected[flushed:])
+            if not collected:
+                yield self._fallback_answer(user_input, mode)
+
+    def _fallback_answer(self, question: str, mode: str) -> str:
+        q = question.lower()
+        for keywords, answer in FALLBACK_ANSWERS:
+            if all(k in q for k in keywords):
+                return answer
+
+        return DEFAULT_FALLBACK_ANSWER